@@ -0,0 +1,199 @@
+# Admission control for /runSAT.
+#
+# The solve time of a request is predicted from the features of the instance with a
+# power law fitted on the recorded runs. Cheap requests go to the fast queue, expensive
+# ones to the slow queue, the ones too expensive for the SAT engine are sent to the
+# heuristic engine and, when the queue is full for too long, the request is rejected
+# so that small jobs keep a low latency during bursts of large ones.
+
+import os
+import json
+import math
+import threading
+
+from django.conf import settings
+
+from .movers_sat_solver import build_instance, search_bounds
+from .schedules import greedy_assignment, schedule_from_assignment, schedule_length
+
+DEFAULT_ADMISSION = {
+    # Predicted seconds under which a request uses the fast queue
+    'fast_limit': 2.0,
+    # Predicted seconds over which the SAT engine is replaced by the heuristic one
+    'slow_limit': 60.0,
+    # Time limit of the heuristic engine
+    'heuristic_time_limit': 10.0,
+    # Time limits of the hierarchical and decomposition engines
+    'hierarchical_time_limit': 2.0,
+    'decompose_time_limit': 10.0,
+    # Concurrent solves in each queue
+    'fast_slots': 4,
+    'slow_slots': 1,
+    # Concurrent solves of the engines that go through the z3 API (smt and warm=1), in a
+    # queue of their own whatever their estimate
+    'api_slots': 1,
+    # Seconds a request waits for a slot before being rejected with a 429
+    'queue_timeout': 5.0,
+    # File the runs are recorded in (one JSON per line), None to disable
+    'runs_log': None,
+    # Recorded runs needed before the model is fitted on them
+    'min_runs': 5,
+    # Last recorded runs the model is fitted on, the log is compacted to them when it
+    # grows to twice as many
+    'max_runs': 1000,
+}
+
+
+def admission_settings():
+    config = dict(DEFAULT_ADMISSION)
+    config.update(getattr(settings, 'MOVERS_ADMISSION', {}))
+    return config
+
+
+def count_clauses(steps, vans, parcels, cities):
+    # Number of clauses `genClauses` produces for this horizon
+    V, P, C = vans, parcels, cities
+    R = 2 * (C - 1)
+    position = (C * (C - 1) // 2) * (V + P) + V + P + V * P * (P - 1) // 2 + V * P * C * C + V * P
+    movement = V * C + P * C + R * V * (3 + P) + V * (1 + P * (P + 3 * C + 3)) + P
+    return V + 2 * P + (steps + 1) * position + steps * movement
+
+
+def instance_features(items_l, workers):
+    floors, roads, items, parcels = build_instance(items_l)
+    vans = ["v_%d" % v for v in range(0, workers)]
+    lower, upper = search_bounds(items_l, workers)
+    greedy = schedule_length(schedule_from_assignment(greedy_assignment(items, vans), items))
+    upper = greedy if upper is None else min(upper, greedy)
+    return {
+        'floors': len(floors),
+        'items': len(parcels),
+        'workers': workers,
+        'lower_bound': lower,
+        'upper_bound': upper,
+        # The step loop encodes the horizons from the lower bound up to the optimum
+        'clauses': sum(count_clauses(h, workers, len(parcels), len(floors)) for h in range(lower, upper + 1)),
+    }
+
+
+class CostModel:
+    # seconds = exp(a) * clauses ^ b, fitted by least squares on log(seconds).
+    # The defaults come from the test cases of test_cases.md on a laptop.
+
+    def __init__(self, a=-12.2, b=1.23, min_runs=5, max_runs=1000):
+        self.a = a
+        self.b = b
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.runs = []
+        # Lines of the log file
+        self.logged = 0
+        self.lock = threading.Lock()
+
+    def estimate(self, features):
+        return math.exp(self.a) * max(features['clauses'], 1) ** self.b
+
+    def load(self, path):
+        try:
+            with open(path) as fl:
+                self.runs = [json.loads(line) for line in fl if line.strip()]
+        except FileNotFoundError:
+            self.runs = []
+        self.logged = len(self.runs)
+        self.runs = self.runs[-self.max_runs:]
+        if self.logged > len(self.runs):
+            self.compact(path)
+        self.calibrate()
+
+    def compact(self, path):
+        # Rewrites the log with the runs the model is fitted on, replacing it at once
+        temporary = str(path) + ".tmp"
+        with open(temporary, 'w') as fl:
+            for run in self.runs:
+                fl.write(json.dumps(run) + "\n")
+        os.replace(temporary, path)
+        self.logged = len(self.runs)
+
+    def record(self, features, elapsed, path=None):
+        run = dict(features, elapsed=elapsed)
+        with self.lock:
+            self.runs.append(run)
+            del self.runs[:-self.max_runs]
+            if path is not None:
+                with open(path, 'a') as fl:
+                    fl.write(json.dumps(run) + "\n")
+                self.logged += 1
+                if self.logged >= 2 * self.max_runs:
+                    self.compact(path)
+            self.calibrate()
+
+    def calibrate(self):
+        points = [(math.log(max(r['clauses'], 1)), math.log(max(r['elapsed'], 1e-3))) for r in self.runs]
+        if len(points) < self.min_runs:
+            return
+        n = len(points)
+        mx = sum(x for x, y in points) / n
+        my = sum(y for x, y in points) / n
+        var = sum((x - mx) ** 2 for x, y in points)
+        if var == 0:
+            self.a = my - self.b * mx
+            return
+        self.b = sum((x - mx) * (y - my) for x, y in points) / var
+        self.a = my - self.b * mx
+
+
+class Admission:
+    # Decides the queue of a request and hands out the slots of the queues
+
+    def __init__(self, config):
+        self.config = config
+        self.model = CostModel(min_runs=config['min_runs'], max_runs=config['max_runs'])
+        if config['runs_log'] is not None:
+            self.model.load(config['runs_log'])
+        self.queues = {
+            'fast': threading.BoundedSemaphore(config['fast_slots']),
+            'slow': threading.BoundedSemaphore(config['slow_slots']),
+            'api': threading.BoundedSemaphore(config['api_slots']),
+        }
+
+    def time_limit(self, mode):
+        # Seconds the engine stops after, None if it runs to the optimum
+        return {
+            'lns': self.config['heuristic_time_limit'],
+            'hierarchical': self.config['hierarchical_time_limit'],
+            'decompose': self.config['decompose_time_limit'],
+        }.get(mode)
+
+    def route(self, features, mode='sat', warm=False):
+        # Returns (queue, mode, estimated seconds). Every engine is queued on its estimate,
+        # the engines with a time limit never take longer than it, but the ones that solve
+        # through the z3 API have a queue of their own.
+        estimate = self.model.estimate(features)
+        if mode == 'sat' and estimate > self.config['slow_limit']:
+            mode = 'lns'
+        if self.time_limit(mode) is not None:
+            estimate = min(estimate, self.time_limit(mode))
+        if mode == 'smt' or (mode == 'sat' and warm):
+            return 'api', mode, estimate
+        if estimate <= self.config['fast_limit']:
+            return 'fast', mode, estimate
+        return 'slow', mode, estimate
+
+    def acquire(self, queue):
+        return self.queues[queue].acquire(timeout=self.config['queue_timeout'])
+
+    def release(self, queue):
+        self.queues[queue].release()
+
+    def record(self, features, elapsed):
+        self.model.record(features, elapsed, self.config['runs_log'])
+
+
+_admission = None
+
+
+def get_admission():
+    global _admission
+    if _admission is None:
+        _admission = Admission(admission_settings())
+    return _admission
@@ -0,0 +1,94 @@
+# Persistent index of the proven results of the step search.
+#
+# The optimal number of steps is monotone: adding items (or moving them to a higher floor
+# by adding floors) never lowers it and adding workers never raises it. An instance is
+# described by its workers and the number of items on every floor, so any instance with
+# at least as many workers and at most as many items on every floor gives a lower bound
+# and any instance with at most as many workers and at least as many items on every floor
+# gives an upper bound.
+# Every result that improves the bounds of its instance is appended as a JSON line to the
+# index file, so the bounds keep getting better as requests are solved. The file is
+# rewritten with one line per instance when it is loaded.
+
+import os
+import json
+import threading
+
+
+def floor_counts(items_l):
+    # Items on the ground floor need no step, trailing empty floors do not matter
+    counts = [len(floor) for floor in items_l[1:]]
+    while counts and counts[-1] == 0:
+        counts.pop()
+    return tuple(counts)
+
+
+def at_most(counts, other):
+    # Every floor of counts has at most the items of the same floor of other
+    if len(counts) > len(other):
+        return False
+    return all(c <= o for c, o in zip(counts, other))
+
+
+class BoundsIndex:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if path is not None:
+            lines = 0
+            try:
+                with open(path) as fl:
+                    for line in fl:
+                        if line.strip():
+                            self.add(json.loads(line))
+                            lines += 1
+            except FileNotFoundError:
+                pass
+            if lines > len(self.entries):
+                self.compact()
+
+    def add(self, entry):
+        # Merge the entry with what is known of the same instance, returns the merged
+        # entry if it improves the known bounds, None otherwise
+        key = (entry['workers'], tuple(entry['counts']))
+        known = self.entries.get(key, {'lower': 0, 'upper': None})
+        upper = entry.get('upper')
+        if known['upper'] is not None and (upper is None or known['upper'] < upper):
+            upper = known['upper']
+        merged = {'lower': max(known['lower'], entry.get('lower', 0)), 'upper': upper}
+        if key in self.entries and merged == known:
+            return None
+        self.entries[key] = merged
+        return {'workers': key[0], 'counts': list(key[1]), **merged}
+
+    def compact(self):
+        # Rewrites the file with one line per instance, replacing it at once so that a
+        # crash leaves either the old or the new file
+        temporary = self.path + ".tmp"
+        with open(temporary, 'w') as fl:
+            for (workers, counts), known in self.entries.items():
+                fl.write(json.dumps({'workers': workers, 'counts': list(counts), **known}) + "\n")
+        os.replace(temporary, self.path)
+
+    def record(self, workers, counts, lower=0, upper=None):
+        # lower: every horizon below it is UNSAT, upper: a plan of that many steps exists
+        entry = {'workers': workers, 'counts': list(counts), 'lower': lower, 'upper': upper}
+        with self.lock:
+            merged = self.add(entry)
+            if merged is not None and self.path is not None:
+                with open(self.path, 'a') as fl:
+                    fl.write(json.dumps(merged) + "\n")
+
+    def bounds(self, workers, counts):
+        # Best known (lower, upper) bounds of the instance, upper is None if unknown
+        lower = 0
+        upper = None
+        with self.lock:
+            for (w, c), known in self.entries.items():
+                if w >= workers and at_most(c, counts):
+                    lower = max(lower, known['lower'])
+                if w <= workers and at_most(counts, c) and known['upper'] is not None:
+                    upper = known['upper'] if upper is None else min(upper, known['upper'])
+        return lower, upper
@@ -0,0 +1,174 @@
+# Simplification of the clauses of `genClauses` before they are written for the SAT solver.
+#
+# - duplicated literals, tautologies and duplicated clauses are dropped
+# - unit clauses (initial and final states) are propagated
+# - subsumed clauses are removed
+# - auxiliary variables (canTransport, moves) are eliminated by resolution, as long as
+#   this does not add clauses (bounded variable elimination)
+# The returned Reconstruction turns a model of the simplified clauses back into a full
+# assignment, so the decoding of the solver output does not change.
+
+
+class Reconstruction:
+
+    def __init__(self):
+        # Variables fixed by unit propagation
+        self.units = {}
+        # (variable, clauses containing it positively) in order of elimination
+        self.eliminated = []
+        self.unsatisfiable = False
+
+    def extend(self, model):
+        # model maps variable -> bool, missing variables are False
+        full = dict(model)
+        full.update(self.units)
+        for var, clauses in reversed(self.eliminated):
+            full[var] = False
+            for clause in clauses:
+                if not any(full.get(abs(l), False) == (l > 0) for l in clause if abs(l) != var):
+                    full[var] = True
+                    break
+        return full
+
+
+def normalize(clauses):
+    seen = set()
+    result = []
+    for clause in clauses:
+        lits = frozenset(clause)
+        if any(-l in lits for l in lits) or lits in seen:
+            continue
+        seen.add(lits)
+        result.append(lits)
+    return result
+
+
+def propagate_units(clauses, info):
+    # Returns the clauses left once the units are assigned, None on a conflict
+    occurs = {}
+    for idx, clause in enumerate(clauses):
+        for l in clause:
+            occurs.setdefault(l, []).append(idx)
+    remaining = [set(c) for c in clauses]
+    satisfied = [False] * len(clauses)
+    queue = [next(iter(c)) for c in clauses if len(c) == 1]
+
+    while queue:
+        l = queue.pop()
+        if abs(l) in info.units:
+            if info.units[abs(l)] != (l > 0):
+                return None
+            continue
+        info.units[abs(l)] = l > 0
+        for idx in occurs.get(l, []):
+            satisfied[idx] = True
+        for idx in occurs.get(-l, []):
+            if satisfied[idx]:
+                continue
+            remaining[idx].discard(-l)
+            if not remaining[idx]:
+                return None
+            if len(remaining[idx]) == 1:
+                queue.append(next(iter(remaining[idx])))
+
+    return [frozenset(c) for idx, c in enumerate(remaining) if not satisfied[idx]]
+
+
+def remove_subsumed(clauses):
+    occurs = {}
+    for idx, clause in enumerate(clauses):
+        for l in clause:
+            occurs.setdefault(l, []).append(idx)
+
+    removed = set()
+    for idx in sorted(range(len(clauses)), key=lambda i: len(clauses[i])):
+        if idx in removed:
+            continue
+        clause = clauses[idx]
+        # Every clause subsumed by this one contains its least frequent literal
+        rarest = min(clause, key=lambda l: len(occurs[l]))
+        for other in occurs[rarest]:
+            if other != idx and other not in removed and len(clauses[other]) >= len(clause) and clause <= clauses[other]:
+                removed.add(other)
+    return [c for idx, c in enumerate(clauses) if idx not in removed]
+
+
+def eliminate_variables(clauses, variables, info):
+    clauses = set(clauses)
+    occurs = {}
+    for clause in clauses:
+        for l in clause:
+            occurs.setdefault(l, set()).add(clause)
+
+    for var in variables:
+        if var in info.units:
+            continue
+        pos = occurs.get(var, set())
+        neg = occurs.get(-var, set())
+        resolvents = set()
+        for c1 in pos:
+            for c2 in neg:
+                resolvent = (c1 - {var}) | (c2 - {-var})
+                if not any(-l in resolvent for l in resolvent):
+                    resolvents.add(frozenset(resolvent))
+                    if len(resolvents) > len(pos) + len(neg):
+                        break
+            if len(resolvents) > len(pos) + len(neg):
+                break
+        if len(resolvents) > len(pos) + len(neg) or any(not r for r in resolvents):
+            continue
+
+        info.eliminated.append((var, [sorted(c) for c in pos]))
+        for clause in pos | neg:
+            clauses.discard(clause)
+            for l in clause:
+                occurs[l].discard(clause)
+        for clause in resolvents - clauses:
+            clauses.add(clause)
+            for l in clause:
+                occurs.setdefault(l, set()).add(clause)
+    return list(clauses)
+
+
+def preprocess(clauses, eliminate=()):
+    # Returns the simplified clauses and the Reconstruction of the full models
+    info = Reconstruction()
+    simplified = propagate_units(normalize(clauses), info)
+    if simplified is None:
+        info.unsatisfiable = True
+        return [[1], [-1]], info
+    simplified = remove_subsumed(simplified)
+    simplified = eliminate_variables(simplified, eliminate, info)
+    simplified = remove_subsumed(simplified)
+    return [sorted(c, key=abs) for c in simplified], info
+
+
+def assign_units(clauses, info):
+    # Clauses added after the preprocessing, with the variables fixed by the unit propagation
+    # replaced by their values: the satisfied clauses are dropped and the false literals
+    # removed. None on a conflict.
+    result = []
+    for clause in clauses:
+        if any(info.units.get(abs(l)) == (l > 0) for l in clause):
+            continue
+        clause = [l for l in clause if abs(l) not in info.units]
+        if not clause:
+            return None
+        result.append(clause)
+    return result
+
+
+def reconstruct_output(res, info, var_count):
+    # Rewrites the output of the SAT solver with the full assignment
+    lines = res.strip().split('\n')
+    if lines[0] != "s SATISFIABLE":
+        return res
+    model = {}
+    for line in lines[1:]:
+        if line.startswith('v'):
+            for l in map(int, line.split()[1:]):
+                if l != 0:
+                    model[abs(l)] = l > 0
+    full = info.extend(model)
+    asgn = [v if full.get(v, False) else -v for v in range(1, var_count + 1)]
+    return "s SATISFIABLE\nv " + " ".join(map(str, asgn)) + " 0\n"
@@ -1,9 +1,38 @@
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from .movers_sat_solver import run_sat_solver
-from .utils import parse_SAT_facts_by_time, parse_SAT_facts_by_workers
+from .lns_optimizer import lns_optimize, run_lns_solver
+from .decomposition import run_decomposition_solver
+from .movers_smt_solver import run_smt_solver, smt_search
+from .hierarchical import run_hierarchical_solver
+from .admission import get_admission, instance_features, CostModel
+from .warm_start import run_warm_sat_solver
+from .replanning import replan as replan_from_state, delivers as replan_delivers
+from . import movers_sat_solver
+from .movers_sat_solver import main, build_instance
+from .bounds_index import BoundsIndex
+from .schedules import lower_bound_steps, facts_to_schedule, simulate_schedule
+from .benchmarks import TEST_CASES, GAP_CASES
+from .utils import parse_SAT_facts_by_time, parse_SAT_facts_by_workers, parse_SAT_facts_compact, fast_json_response, fast_json_dumps
+import re
 import json
+import math
+import time
+import zlib
+import threading
+import contextlib
 from django.views.decorators.csrf import csrf_exempt
 from django.test import RequestFactory
+from django.utils.cache import patch_vary_headers
+
+# Engines selectable with the mode parameter of /runSAT, all of them return
+# the true facts of the plan, the result of the solver and the steps + 1
+SOLVERS = {
+    'sat': run_sat_solver,
+    'lns': run_lns_solver,
+    'decompose': run_decomposition_solver,
+    'smt': run_smt_solver,
+    'hierarchical': run_hierarchical_solver,
+}
 
 @csrf_exempt
 def hello_world(request):
@@ -12,21 +41,224 @@ def hello_world(request):
 @csrf_exempt
 def run_SAT(request):
     man = request.GET.get('man')
+    # format=compact returns the per worker timeline instead of the facts by time,
+    # the raw SAT facts are then only included with raw=1
+    response_format = request.GET.get('format', 'full')
+    raw = request.GET.get('raw', '0') == '1'
+    mode = request.GET.get('mode', 'sat')
+    # warm=1 gives the solver the plan of a similar request (or the greedy plan) as hints
+    warm = request.GET.get('warm', '0') == '1'
     data = json.loads(request.body.decode('utf-8'))
     items_l = data.get('items_list', [])
 
-    SAT_facts, SAT_result, SAT_STEPS = run_sat_solver(workers=int(man), items_l=items_l)
+    if mode not in SOLVERS:
+        return JsonResponse({'error': "Unknown mode '%s'" % mode}, status=400)
+
+    # Route the request on its predicted solve time, reject it if its queue stays full
+    admission = get_admission()
+    features = instance_features(items_l, int(man))
+    queue, mode, estimate = admission.route(features, mode, warm)
+    if not admission.acquire(queue):
+        response = JsonResponse({
+            'error': 'Too many requests',
+            'queue': queue,
+            'estimated_time': estimate,
+        }, status=429)
+        response['Retry-After'] = str(math.ceil(estimate))
+        return response
+
+    try:
+        started = time.time()
+        time_limit = admission.time_limit(mode)
+        extra = {'time_limit': time_limit} if time_limit is not None else {}
+        solver = run_warm_sat_solver if mode == 'sat' and warm else SOLVERS[mode]
+        SAT_facts, SAT_result, SAT_STEPS = solver(workers=int(man), items_l=items_l, **extra)
+        # The model predicts the command line solver, the warm runs go through the z3 API
+        if mode == 'sat' and not warm:
+            admission.record(features, time.time() - started)
+    finally:
+        admission.release(queue)
+
+    if response_format == 'compact':
+        response = {
+            "is_satisfiable": SAT_result,
+            'steps': SAT_STEPS-1,
+            'engine': mode,
+            'plan': parse_SAT_facts_compact(SAT_facts or [], SAT_STEPS-1),
+        }
+        if raw:
+            response["SAT_facts"] = SAT_facts
+        return fast_json_response(response)
+
     facts = parse_SAT_facts_by_time(SAT_facts)
 
-    return JsonResponse({
+    return fast_json_response({
         "is_satisfiable": SAT_result,
         'steps': SAT_STEPS-1,
+        'engine': mode,
         'facts': facts,
         "SAT_facts": SAT_facts,
 
     })
 
+@csrf_exempt
+def run_LNS(request):
+    # Anytime optimization for large instances: streams one JSON line for every
+    # improved plan found within time_limit seconds, the last line is the best plan
+    man = request.GET.get('man')
+    time_limit = float(request.GET.get('time_limit', 10))
+    data = json.loads(request.body.decode('utf-8'))
+    items_l = data.get('items_list', [])
+
+    # GZipMiddleware only flushes a compressed stream at its end, so the lines are compressed
+    # here and flushed one by one, the middleware skips responses with a Content-Encoding
+    gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+    def stream():
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        for result in lns_optimize(items_l=items_l, workers=int(man), time_limit=time_limit):
+            line = fast_json_dumps({
+                "is_satisfiable": 'SATISFIABLE',
+                'steps': result['steps'],
+                'optimal': result['optimal'],
+                'elapsed': result['elapsed'],
+                'facts': parse_SAT_facts_by_time(result['facts']),
+            }) + b"\n"
+            if gzip:
+                line = compressor.compress(line) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield line
+        if gzip:
+            yield compressor.flush()
+
+    response = StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+# A true fact as returned by the solvers, name(time,arguments...)
+FACT = re.compile(r"^[A-Za-z]+\(\d+(,[^,()]+)+\)$")
+
+@csrf_exempt
+def replan(request):
+    # Plan of the rest of a move from its current state: the floors of the workers, the
+    # items they are holding and the floors of the items left (new ones included).
+    # The SAT_facts of the previous plan and the step the state was reached at (time)
+    # are optional, the times of the new plan start from the state.
+    time_limit = float(request.GET.get('time_limit', 1))
+    data = json.loads(request.body.decode('utf-8'))
+    workers = {v: str(f) for v, f in data.get('workers', {}).items()}
+    holding = data.get('holding', {})
+    items = {p: str(f) for p, f in data.get('items', {}).items()}
+
+    if not workers:
+        return JsonResponse({'error': 'No workers'}, status=400)
+    for name, f in list(workers.items()) + list(items.items()):
+        if not f.isdigit():
+            return JsonResponse({'error': "The floor of %s is not a floor number (%s)" % (name, f)}, status=400)
+    for v, p in holding.items():
+        if v not in workers or items.get(p) != workers[v]:
+            return JsonResponse({'error': "%s is not holding %s" % (v, p)}, status=400)
+    floors_count = data.get('floors')
+    if floors_count is not None:
+        highest = max(int(f) for f in list(workers.values()) + list(items.values()))
+        if not isinstance(floors_count, int) or floors_count <= highest:
+            return JsonResponse({'error': "floors must be more than the highest floor (%d)" % highest}, status=400)
+    previous_plan = data.get('SAT_facts')
+    if previous_plan is not None:
+        if not isinstance(previous_plan, list):
+            return JsonResponse({'error': 'SAT_facts is not a list of facts'}, status=400)
+        for fact in previous_plan:
+            if not isinstance(fact, str) or not FACT.match(fact):
+                return JsonResponse({'error': "Malformed fact %s" % json.dumps(fact)}, status=400)
+    start = data.get('time', 0)
+    if not isinstance(start, int) or start < 0:
+        return JsonResponse({'error': 'time must be a step number'}, status=400)
+
+    SAT_facts, SAT_result, SAT_STEPS, engine = replan_from_state(
+        workers, holding, items,
+        floors_count=floors_count,
+        previous_plan=previous_plan,
+        start=start,
+        time_limit=time_limit)
+
+    return fast_json_response({
+        "is_satisfiable": SAT_result,
+        'steps': SAT_STEPS-1,
+        'engine': engine,
+        'facts': parse_SAT_facts_by_time(SAT_facts),
+        "SAT_facts": SAT_facts,
+    })
+
+def plan_delivers(items_l, workers, SAT_facts, steps):
+    # The plan follows the rules of the model and ends with every item on the ground floor
+    floors, roads, items, parcels = build_instance(items_l)
+    vans = ["v_%d" % v for v in range(0, workers)]
+    try:
+        states = simulate_schedule(facts_to_schedule(SAT_facts, vans, steps), items)
+    except (ValueError, KeyError):
+        return False
+    return all(f == '0' for f in states[-1][1].values())
+
+
+def optimal_steps(items_l, workers, preprocess_cnf=None, implied=None):
+    # Step search from the lower bound with or without the preprocessing of the clauses
+    # and the implied constraints
+    floors, roads, items, parcels = build_instance(items_l)
+    steps = lower_bound_steps(items, workers)
+    while main(steps, floors, roads, items, workers, parcels, preprocess_cnf=preprocess_cnf, implied=implied)[1] != 'SATISFIABLE':
+        steps += 1
+    return steps
+
+
+def replan_from_start(items_l, workers):
+    # Replanning from the initial state of a test case, every worker on the ground floor
+    floors, roads, items, parcels = build_instance(items_l)
+    return replan_from_state({"v_%d" % v: '0' for v in range(0, workers)}, {}, items)[:3]
+
+
+def solve_concurrently(solver, cases):
+    # Solves the test cases at the same time, one thread each, returns by case the steps
+    # of the plan found or the error raised
+    results = {}
+
+    def solve(case):
+        items_l, workers, expected_steps = TEST_CASES[case]
+        try:
+            results[case] = solver(items_l, workers)[2] - 1
+        except Exception as error:
+            results[case] = repr(error)
+
+    threads = [threading.Thread(target=solve, args=(case,)) for case in cases]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+@contextlib.contextmanager
+def isolated_state():
+    # The checks use an empty bounds index in memory and a copy of the cost model that
+    # records nothing, the ones of the server do not change
+    admission = get_admission()
+    saved = movers_sat_solver.gBoundsIndex, admission.model, admission.config
+    movers_sat_solver.gBoundsIndex = BoundsIndex()
+    admission.model = CostModel(admission.model.a, admission.model.b, admission.model.min_runs, admission.model.max_runs)
+    admission.model.runs = list(saved[1].runs)
+    admission.config = dict(admission.config, runs_log=None)
+    try:
+        yield
+    finally:
+        movers_sat_solver.gBoundsIndex, admission.model, admission.config = saved
+
+
 def run_tests(request):
+    with isolated_state():
+        return run_checks()
+
+
+def run_checks():
     factory = RequestFactory()
 
     print("-----------------------------------\nRunning test 1:")
@@ -77,7 +309,198 @@ def run_tests(request):
     test3_steps = response_test3_data.get('steps', 0)
 
 
+    # Every engine on the test cases of test_cases.md, and the sat engine with warm=1: the
+    # plan has to deliver every item, sat and smt have to find the optimum and the other
+    # engines cannot beat it
+    engine_tests = {}
+    for mode in list(SOLVERS) + ['warm']:
+        for case, (items_l, workers, expected_steps) in TEST_CASES.items():
+            print("-----------------------------------\nRunning engine %s on case %d:" % (mode, case))
+            request_engine = factory.post(
+                '/run_SAT?man=%d&mode=sat&warm=1' % workers if mode == 'warm' else
+                '/run_SAT?man=%d&mode=%s' % (workers, mode),
+                data=json.dumps({'items_list': items_l}),
+                content_type='application/json'
+            )
+            response_engine = run_SAT(request_engine)
+            response_engine_data = json.loads(response_engine.content)
+            steps = response_engine_data.get('steps', 0)
+            delivers = plan_delivers(items_l, workers, response_engine_data.get('SAT_facts') or [], steps)
+            engine_tests["engine_%s_%d" % (mode, case)] = {
+                "status_code": response_engine.status_code,
+                "passed": delivers and (steps == expected_steps if mode in ('sat', 'smt', 'warm') else steps >= expected_steps),
+                "details":
+                {
+                    'workers': workers,
+                    'items_list': items_l,
+                    'engine': response_engine_data.get('engine'),
+                    'expected_steps': expected_steps,
+                    'actual_steps': steps,
+                    'plan_delivers': delivers,
+                }
+            }
+
+    # The preprocessing of the clauses does not change the optimum
+    preprocess_cases = [1, 2, 3, 7, 9]
+    print("-----------------------------------\nRunning preprocessing test:")
+    with_preprocessing = [optimal_steps(*TEST_CASES[case][:2], preprocess_cnf=True) for case in preprocess_cases]
+    without_preprocessing = [optimal_steps(*TEST_CASES[case][:2], preprocess_cnf=False) for case in preprocess_cases]
+
+    # The implied constraints do not change the optimum, on instances whose optimum is above
+    # the lower bound. Without them the proofs take a few minutes.
+    implied_cases = [11, 12]
+    print("-----------------------------------\nRunning implied constraints test:")
+    with_implied = [optimal_steps(*GAP_CASES[case][:2]) for case in implied_cases]
+    without_implied = [optimal_steps(*GAP_CASES[case][:2], implied=[]) for case in implied_cases]
+
+    # Solves of the z3 API engines running at the same time do not interfere
+    concurrent_cases = [2, 5, 7, 9, 10]
+    print("-----------------------------------\nRunning concurrent smt test:")
+    concurrent_smt = solve_concurrently(smt_search, concurrent_cases)
+    print("-----------------------------------\nRunning concurrent warm start test:")
+    concurrent_warm = solve_concurrently(run_warm_sat_solver, concurrent_cases)
+
+    print("-----------------------------------\nRunning concurrent replan test:")
+    concurrent_replan = solve_concurrently(replan_from_start, concurrent_cases)
+
+    # Replanning from the middle of a move, and a state it has to reject
+    print("-----------------------------------\nRunning replan test:")
+    replan_state = {
+        'workers': {'v_0': '2', 'v_1': '0'},
+        'holding': {'v_0': 'tv2_floor3'},
+        'items': {'tv2_floor3': '2', 'lamp1_floor3': '3', 'box1_floor1': '1', 'piano': '3'},
+    }
+    request_replan = factory.post('/replan', data=json.dumps(replan_state), content_type='application/json')
+    response_replan = replan(request_replan)
+    response_replan_data = json.loads(response_replan.content)
+    replan_steps = response_replan_data.get('steps', 0)
+    replan_schedule = facts_to_schedule(response_replan_data.get('SAT_facts', []), sorted(replan_state['workers']), replan_steps)
+    replan_passed = response_replan.status_code == 200 and replan_delivers(
+        replan_schedule, replan_state['workers'], replan_state['holding'], replan_state['items'])
+    request_replan_invalid = factory.post('/replan', data=json.dumps({'workers': {'v_0': -1}, 'items': {'a': 1}}),
+                                          content_type='application/json')
+    response_replan_invalid = replan(request_replan_invalid)
+
+    # Bounds of an instance from the results of the instances that dominate it
+    bounds_index = BoundsIndex()
+    bounds_index.record(3, (2, 1), lower=8)
+    bounds_index.record(1, (2, 2), upper=16)
+    bounds_lower, bounds_upper = bounds_index.bounds(2, (2, 1))
+    bounds_expected = (8, 16)
+
+    # Compact format of a plan: one action code per step, the pickups and the floor deltas
+    print("-----------------------------------\nRunning compact format test:")
+    compact_items, compact_workers, compact_expected_steps = TEST_CASES[3]
+    request_compact = factory.post(
+        '/run_SAT?man=%d&format=compact&raw=1' % compact_workers,
+        data=json.dumps({'items_list': compact_items}),
+        content_type='application/json'
+    )
+    response_compact = run_SAT(request_compact)
+    response_compact_data = json.loads(response_compact.content)
+    compact_plan = response_compact_data.get('plan', {})
+    compact_facts = response_compact_data.get('SAT_facts', [])
+    compact_passed = (
+        response_compact_data.get('steps') == compact_expected_steps and
+        all(len(codes) == compact_expected_steps for codes in compact_plan.get('timeline', {}).values()) and
+        sum(len(p) for p in compact_plan.get('pickups', {}).values()) == len([f for f in compact_facts if f.startswith('pickingUp')]) and
+        # Up (1, 4) and down (2, 5) codes are the deltas of the floor trace
+        all(compact_plan['positions'][w][1:] == [{1: 1, 4: 1, 2: -1, 5: -1}.get(c, 0) for c in codes]
+            for w, codes in compact_plan.get('timeline', {}).items())
+    )
+
     return JsonResponse({
+        **engine_tests,
+        "preprocessing": {
+            "status_code": 200,
+            "passed": with_preprocessing == without_preprocessing,
+            "details":
+            {
+                'cases': preprocess_cases,
+                'steps_with_preprocessing': with_preprocessing,
+                'steps_without_preprocessing': without_preprocessing,
+            }
+        },
+        "implied_constraints": {
+            "status_code": 200,
+            "passed": with_implied == without_implied == [GAP_CASES[case][2] for case in implied_cases],
+            "details":
+            {
+                'cases': implied_cases,
+                'expected_steps': [GAP_CASES[case][2] for case in implied_cases],
+                'steps_with_implied': with_implied,
+                'steps_without_implied': without_implied,
+            }
+        },
+        "concurrent_smt": {
+            "status_code": 200,
+            "passed": all(concurrent_smt[case] == TEST_CASES[case][2] for case in concurrent_cases),
+            "details":
+            {
+                'cases': concurrent_cases,
+                'expected_steps': [TEST_CASES[case][2] for case in concurrent_cases],
+                'actual_steps': [concurrent_smt[case] for case in concurrent_cases],
+            }
+        },
+        "concurrent_warm": {
+            "status_code": 200,
+            "passed": all(concurrent_warm[case] == TEST_CASES[case][2] for case in concurrent_cases),
+            "details":
+            {
+                'cases': concurrent_cases,
+                'expected_steps': [TEST_CASES[case][2] for case in concurrent_cases],
+                'actual_steps': [concurrent_warm[case] for case in concurrent_cases],
+            }
+        },
+        "concurrent_replan": {
+            "status_code": 200,
+            "passed": all(isinstance(concurrent_replan[case], int) and concurrent_replan[case] >= TEST_CASES[case][2]
+                          for case in concurrent_cases),
+            "details":
+            {
+                'cases': concurrent_cases,
+                'optimal_steps': [TEST_CASES[case][2] for case in concurrent_cases],
+                'actual_steps': [concurrent_replan[case] for case in concurrent_cases],
+            }
+        },
+        "replan": {
+            "status_code": response_replan.status_code,
+            "passed": replan_passed,
+            "details":
+            {
+                'state': replan_state,
+                'actual_steps': replan_steps,
+                'engine': response_replan_data.get('engine'),
+            }
+        },
+        "replan_invalid_state": {
+            "status_code": response_replan_invalid.status_code,
+            "passed": response_replan_invalid.status_code == 400,
+            "details":
+            {
+                'error': json.loads(response_replan_invalid.content).get('error'),
+            }
+        },
+        "bounds_index": {
+            "status_code": 200,
+            "passed": (bounds_lower, bounds_upper) == bounds_expected,
+            "details":
+            {
+                'expected_bounds': list(bounds_expected),
+                'actual_bounds': [bounds_lower, bounds_upper],
+            }
+        },
+        "compact_format": {
+            "status_code": response_compact.status_code,
+            "passed": compact_passed,
+            "details":
+            {
+                'workers': compact_workers,
+                'items_list': compact_items,
+                'expected_steps': compact_expected_steps,
+                'actual_steps': response_compact_data.get('steps'),
+            }
+        },
         "test_1": {
             "status_code": response_test1.status_code,
             "passed": test1_is_satisfiable == test1_expected_is_satisfiable and
@@ -0,0 +1,112 @@
+# Two level decomposition of the movers problem, to use more than one core.
+#
+# The master assigns the items to the workers with the smallest maximum trip load (the
+# branch and bound of hierarchical.py), every worker starts as a team of its own with its
+# items. The master then repeats rounds driven by the makespans of the teams: every team on
+# the critical path (as long as the whole plan) forms a crew with the least loaded team it
+# was not tried with, and the items of both are planned again as one SAT problem, where the
+# workers can also carry items together or hand them over. The horizons below the makespan
+# are solved in parallel in a process pool shared by the requests, and the shortest plan
+# found replaces the plans of the two teams, that become one. The crew makespans found this
+# way decide the critical teams and partners of the next round.
+
+import io
+import os
+import time
+import threading
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, wait
+
+from .movers_sat_solver import main, build_instance
+from .hierarchical import optimal_assignment
+from .schedules import (lower_bound_steps, schedule_from_assignment, schedule_length, worker_length,
+                        pad_schedule, schedule_to_facts, facts_to_schedule)
+
+# Process pools shared by all the requests, by number of processes
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(processes=None):
+    processes = processes or os.cpu_count()
+    with _pools_lock:
+        if processes not in _pools:
+            _pools[processes] = ProcessPoolExecutor(max_workers=processes)
+        return _pools[processes]
+
+
+def solve_crew(crew, parcels, items, floors, roads, steps, deadline):
+    # Plan of a crew in steps, as a schedule of its workers (None if there is none or the
+    # deadline comes first), runs in a pool process
+    sub_items = {p: items[p] for p in parcels}
+    with contextlib.redirect_stdout(io.StringIO()):
+        facts, res = main(steps, floors, roads, sub_items, len(crew), list(parcels), vans=list(crew),
+                          timeout=max(deadline - time.time(), 0.1))
+    return steps, facts_to_schedule(facts, list(crew), steps) if res == 'SATISFIABLE' else None
+
+
+def run_decomposition_solver(items_l=[], workers=3, processes=None, crew_size=4, time_limit=10.0):
+    started = time.time()
+    deadline = started + time_limit
+    floors, roads, items, parcels = build_instance(items_l)
+    vans = ["v_%d" % v for v in range(0, workers)]
+    lower = lower_bound_steps(items, workers)
+
+    # Master: the assignment of the items to the workers and its plan
+    assignment, makespan = optimal_assignment(items, vans, deadline)
+    schedule = schedule_from_assignment(assignment, items)
+    teams = {(v,): list(assignment[v]) for v in vans}
+    tried = set()
+
+    pool = get_pool(processes)
+    while time.time() < deadline:
+        spans = {team: max(worker_length(schedule, v) for v in team) for team in teams}
+        makespan = max(spans.values())
+        if makespan <= lower:
+            break
+
+        # Crews of the critical teams and their partners, the whole plan cannot get shorter
+        # if one of the critical teams has no partner left
+        crews = []
+        partnered = set()
+        for team in sorted([t for t in teams if spans[t] == makespan], key=len):
+            partners = [t for t in sorted(teams, key=lambda t: (spans[t], len(t)))
+                        if t != team and t not in partnered and len(t) + len(team) <= crew_size
+                        and (team, t) not in tried]
+            if not partners:
+                crews = []
+                break
+            partnered.update((team, partners[0]))
+            crews.append((team, partners[0]))
+        if not crews:
+            break
+
+        # Every horizon below the makespan of every crew, in parallel
+        futures = {}
+        for team, partner in crews:
+            crew = team + partner
+            crew_parcels = teams[team] + teams[partner]
+            first = lower_bound_steps({p: items[p] for p in crew_parcels}, len(crew))
+            for steps in range(first, makespan):
+                future = pool.submit(solve_crew, crew, crew_parcels, items, floors, roads, steps, deadline)
+                futures[future] = (team, partner)
+        done, pending = wait(futures, timeout=max(deadline - time.time(), 0))
+        for future in pending:
+            future.cancel()
+
+        best = {}
+        for future in done:
+            steps, crew_schedule = future.result()
+            if crew_schedule is not None and (futures[future] not in best or steps < best[futures[future]][0]):
+                best[futures[future]] = (steps, crew_schedule)
+
+        # Feedback: the crews with a shorter plan become teams, the others are not tried again
+        for team, partner in crews:
+            tried.add((team, partner))
+            if (team, partner) in best:
+                schedule.update(best[(team, partner)][1])
+                teams[team + partner] = teams.pop(team) + teams.pop(partner)
+
+    steps = schedule_length(schedule)
+    facts = schedule_to_facts(pad_schedule(schedule, steps), items)
+    return facts, 'SATISFIABLE', steps + 1
@@ -0,0 +1,109 @@
+# Hierarchical planning: macro-actions first, concrete steps after.
+#
+# At the abstract level an item is fetched by a single macro-action of cost 2f+1 (going up
+# f floors, the pickup and carrying it down), so a plan is only an assignment of the items
+# to the workers and the order does not matter: the shortest plan is the assignment with the
+# smallest maximum load (P||Cmax), found by branch and bound. Every macro-action is then
+# refined into goesTo/pickingUp steps with `schedule_from_assignment`. Unlike the SAT
+# encoding, nothing here grows with the number of floors times the number of steps.
+#
+# Workers carrying the same item together or handing it over are not macro-actions, so
+# the abstract optimum can be above the true one. The plan is optimal when it meets the
+# lower bound of the instance, otherwise the full encoding looks for a shorter plan.
+
+import time
+
+from .movers_sat_solver import main, build_instance, search_bounds, getBoundsIndex, run_sat_solver
+from .bounds_index import floor_counts
+from .admission import CostModel, count_clauses
+from .schedules import trip_cost, greedy_assignment, schedule_from_assignment, schedule_length, \
+    pad_schedule, simulate_schedule, schedule_to_facts
+
+
+def optimal_assignment(items, vans, deadline=None):
+    # Assignment of the items to the vans with the smallest maximum trip load, returns it
+    # and that load. Stops at the first assignment meeting the bound, or at the deadline
+    # with the best assignment found (the greedy one at least).
+    parcels = sorted([p for p in items if trip_cost(items[p]) > 0], key=lambda p: (-trip_cost(items[p]), p))
+    costs = [trip_cost(items[p]) for p in parcels]
+    if not parcels or not vans:
+        return {v: [] for v in vans}, 0
+    bound = max(max(costs), -(-sum(costs) // len(vans)))
+
+    greedy = greedy_assignment(items, vans)
+    best = [max(sum(trip_cost(items[p]) for p in greedy[v]) for v in vans), greedy]
+    loads = [0] * len(vans)
+    chosen = [[] for _ in vans]
+    remaining = [sum(costs[i:]) for i in range(0, len(costs) + 1)]
+
+    def search(i):
+        if best[0] == bound or (deadline is not None and time.time() > deadline):
+            return
+        if i == len(parcels):
+            best[0] = max(loads)
+            best[1] = {v: list(chosen[j]) for j, v in enumerate(vans)}
+            return
+        # The remaining items cannot end before the average load
+        if max(max(loads), -(-(sum(loads) + remaining[i]) // len(vans))) >= best[0]:
+            return
+        tried = set()
+        for j in sorted(range(0, len(vans)), key=lambda j: loads[j]):
+            # Vans with the same load are interchangeable
+            if loads[j] in tried or loads[j] + costs[i] >= best[0]:
+                continue
+            tried.add(loads[j])
+            loads[j] += costs[i]
+            chosen[j].append(parcels[i])
+            search(i + 1)
+            chosen[j].pop()
+            loads[j] -= costs[i]
+
+    search(0)
+    return best[1], best[0]
+
+
+def run_hierarchical_solver(items_l=[], workers=3, time_limit=2.0):
+    # The full encoding only gets what is left of time_limit seconds
+    started = time.time()
+    floors, roads, items, parcels = build_instance(items_l)
+    vans = ["v_%d" % v for v in range(0, workers)]
+    counts = floor_counts(items_l)
+    lower = search_bounds(items_l, workers)[0]
+
+    # Abstract plan, refined into steps
+    assignment, makespan = optimal_assignment(items, vans, started + time_limit)
+    schedule = schedule_from_assignment(assignment, items)
+    steps = schedule_length(schedule)
+    schedule = pad_schedule(schedule, steps)
+    try:
+        delivered = all(f == '0' for f in simulate_schedule(schedule, items)[-1][1].values())
+    except ValueError:
+        delivered = False
+    if steps != makespan or not delivered:
+        # The refinement failed, back to the step search of the full encoding
+        return run_sat_solver(items_l, workers)
+
+    facts = schedule_to_facts(schedule, items)
+    getBoundsIndex().record(workers, counts, upper=steps)
+
+    # Shorter plans with the full encoding, from the refined plan down, as long as the
+    # horizon is predicted to be solved in the time left (twice the estimate of the default
+    # model, that does not count the implied constraints)
+    cost_model = CostModel()
+    step = steps - 1
+    while step >= lower:
+        clauses = count_clauses(step, workers, len(parcels), len(floors))
+        if 2 * cost_model.estimate({'clauses': clauses}) > started + time_limit - time.time():
+            break
+        new_facts, res = main(step, floors, roads, items, workers, parcels,
+                              timeout=started + time_limit - time.time())
+        if res != 'SATISFIABLE':
+            if res == 'UNSATISFIABLE':
+                getBoundsIndex().record(workers, counts, lower=step+1)
+            break
+        facts, steps = new_facts, step
+        getBoundsIndex().record(workers, counts, upper=steps)
+        step -= 1
+    if step < lower:
+        getBoundsIndex().record(workers, counts, lower=steps)
+    return facts, 'SATISFIABLE', steps + 1
@@ -0,0 +1,132 @@
+# Anytime optimizer for instances too big for the monolithic horizon loop.
+#
+# Starts from the greedy schedule and repeatedly re-solves a small neighbourhood of it with
+# the SAT encoding of `movers_sat_solver`, keeping every improvement:
+# - a window of time steps, with the states at its two ends fixed, is solved again in less steps
+# - the critical workers and one of the others are solved again, with their items, from the start
+
+import random
+import time
+
+from .movers_sat_solver import main, build_instance, search_bounds
+from .schedules import (action_parcel, greedy_assignment, schedule_from_assignment, schedule_length,
+                        worker_length, pad_schedule, simulate_schedule, schedule_to_facts,
+                        facts_to_schedule, lower_bound_steps)
+
+
+def solve_window(schedule, items, floors, roads, start, stop, deadline):
+    # Re-solve steps [start, stop) in less than stop - start steps, returns the new schedule or None
+    states = simulate_schedule(schedule, items)
+    vans_start, parcels_start, holding_start = states[start]
+    vans_stop, parcels_stop, holding_stop = states[stop]
+    vans = list(schedule)
+
+    # Items that do not move in the window and nobody holds stay out of the sub-problem
+    parcels = [p for p in items
+               if parcels_start[p] != parcels_stop[p]
+               or any(action_parcel(a) == p for v in vans for a in schedule[v][start:stop])
+               or p in holding_start.values() or p in holding_stop.values()]
+
+    for steps in range(1, stop - start):
+        facts, res = main(steps, floors, roads, {p: parcels_start[p] for p in parcels}, len(vans), parcels,
+                          vans=vans,
+                          van_init_cities=vans_start,
+                          van_final_cities=vans_stop,
+                          parcel_dest_cities={p: parcels_stop[p] for p in parcels},
+                          init_transports=holding_start,
+                          final_transports=holding_stop,
+                          timeout=max(deadline - time.time(), 0.1))
+        if res == 'TIMEOUT':
+            return None
+        if res != 'SATISFIABLE':
+            continue
+        window = facts_to_schedule(facts, vans, steps)
+        candidate = {v: schedule[v][:start] + window[v] + schedule[v][stop:] for v in vans}
+        try:
+            simulate_schedule(candidate, items)
+        except ValueError:
+            # The new window does not connect to the rest of the plan
+            return None
+        return candidate
+    return None
+
+
+def solve_workers(schedule, items, floors, roads, workers, target, deadline):
+    # Re-solve the given workers, with all the items they touch, in less than target steps
+    parcels = {action_parcel(a) for v in workers for a in schedule[v]} - {None}
+    if any(action_parcel(a) in parcels for v in schedule if v not in workers for a in schedule[v]):
+        # Items relayed between the workers in the neighbourhood and the others
+        return None
+    parcels = sorted(parcels)
+    others = max([worker_length(schedule, v) for v in schedule if v not in workers] + [0])
+    if others >= target:
+        return None
+
+    sub_items = {p: items[p] for p in parcels}
+    first = max(lower_bound_steps(sub_items, len(workers)), others, 1)
+    for steps in range(first, target):
+        facts, res = main(steps, floors, roads, sub_items, len(workers), parcels, vans=workers,
+                          timeout=max(deadline - time.time(), 0.1))
+        if res == 'TIMEOUT':
+            return None
+        if res != 'SATISFIABLE':
+            continue
+        sub = facts_to_schedule(facts, workers, steps)
+        candidate = dict(schedule)
+        candidate.update(sub)
+        return candidate
+    return None
+
+
+def lns_optimize(items_l=[], workers=3, time_limit=10.0, window=6, seed=0):
+    # Generator of the improving plans: dicts with the steps, the facts and whether the
+    # plan is known to be optimal (it reached the lower bound), the last one is the best
+    started = time.time()
+    rng = random.Random(seed)
+    floors, roads, items, parcels = build_instance(items_l)
+    vans = ["v_%d" % v for v in range(0, workers)]
+
+    schedule = schedule_from_assignment(greedy_assignment(items, vans), items)
+    best = schedule_length(schedule)
+    schedule = pad_schedule(schedule, best)
+    bound = search_bounds(items_l, workers)[0]
+
+    def report():
+        return {
+            'steps': best,
+            'facts': schedule_to_facts(schedule, items),
+            'optimal': best <= bound,
+            'elapsed': time.time() - started,
+        }
+
+    yield report()
+
+    while best > bound and time.time() - started < time_limit:
+        if rng.random() < 0.5 and best > 1:
+            # Window boundaries right after a pickup would break "pickup then transport"
+            size = min(window, best)
+            starts = [t for t in range(0, best - size + 1)
+                      if t == 0 or all(schedule[v][t - 1][0] != 'pickingUp' for v in vans)]
+            start = rng.choice(starts)
+            candidate = solve_window(schedule, items, floors, roads, start, start + size, started + time_limit)
+        else:
+            critical = [v for v in vans if worker_length(schedule, v) == best]
+            others = [v for v in vans if v not in critical]
+            neighbourhood = critical + ([rng.choice(others)] if others else [])
+            candidate = solve_workers(schedule, items, floors, roads, neighbourhood, best, started + time_limit)
+
+        if candidate is None:
+            continue
+        length = schedule_length(candidate)
+        if length < best:
+            best = length
+            schedule = pad_schedule(candidate, best)
+            yield report()
+
+
+def run_lns_solver(items_l=[], workers=3, time_limit=10.0):
+    # Same result as `run_sat_solver`, the best plan found within the time limit
+    result = None
+    for result in lns_optimize(items_l, workers, time_limit):
+        pass
+    return result['facts'], 'SATISFIABLE', result['steps'] + 1
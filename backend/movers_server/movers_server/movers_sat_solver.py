@@ -11,41 +11,68 @@ defSATsolver="z3"
 import sys
 from subprocess import Popen
 from subprocess import PIPE
+from subprocess import TimeoutExpired
 import re
 import random
 import os
 import shutil
+import tempfile
+import threading
+
+from .cnf_preprocessing import preprocess, assign_units, reconstruct_output
+from .bounds_index import BoundsIndex, floor_counts
+from .schedules import lower_bound_steps
+from .solver_hints import hint_values, solve_with_hints
 
 SATsolver = os.getenv("SAT_SOLVER_PATH", defSATsolver)
 
+## Simplify the clauses before writing them for the SAT solver (see cnf_preprocessing.py)
+preprocessCNF = os.getenv("MOVERS_PREPROCESS_CNF", "1") == "1"
+
+## File of the proven bounds on the steps, shared by all the requests (see bounds_index.py),
+## next to the recorded runs of the admission control whatever the working directory
+boundsIndexPath = os.getenv("MOVERS_BOUNDS_INDEX",
+                            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bounds_index.jsonl"))
+gBoundsIndex = None
+gBoundsIndexLock = threading.Lock()
+
 
-gVarNumberToName = ["invalid"]
-gVarNameToNumber = {}
+## The variable tables of the encoding in progress, one per thread so that requests
+## solved at the same time do not share them
+gVarTables = threading.local()
+
+def varTables():
+    global gVarTables
+    if not hasattr(gVarTables, 'numberToName'):
+        resetVarNames()
+    return gVarTables
 
 def closed_range(start, stop, step=1):
     dir = 1 if (step > 0) else -1
     return range(start, stop + dir, step)
 
 def varCount():
-    global gVarNumberToName
-    return len(gVarNumberToName) - 1
+    return len(varTables().numberToName) - 1
 
 def allVarNumbers():
     return closed_range(1, varCount())
 
 def varNumberToName(num):
-    global gVarNumberToName
-    return gVarNumberToName[num]
+    return varTables().numberToName[num]
 
 def varNameToNumber(name):
-    global gVarNameToNumber
-    return gVarNameToNumber[name]
+    return varTables().nameToNumber[name]
 
 def addVarName(name):
-    global gVarNumberToName
-    global gVarNameToNumber
-    gVarNumberToName.append(name)
-    gVarNameToNumber[name] = varCount()
+    tables = varTables()
+    tables.numberToName.append(name)
+    tables.nameToNumber[name] = varCount()
+
+def resetVarNames():
+    # Every horizon (and every sub-problem) is encoded from scratch
+    global gVarTables
+    gVarTables.numberToName = ["invalid"]
+    gVarTables.nameToNumber = {}
 
 # def printClause(clause):
 #     print(map(lambda x: "%s%s" % (x < 0 and eval("'-'") or eval ("''"), varNumberToName(abs(x))) , clause))
@@ -140,17 +167,37 @@ def genClauses(**kwargs):
     parcel_init_cities = kwargs['parcel_init_cities']
     base_city = kwargs['base_city']
     dest_city = kwargs['dest_city']
+
+    # Optional boundary states, used when only a part of a plan is (re)solved:
+    # van_init_cities/van_final_cities fix the vans at the first/last step,
+    # parcel_dest_cities overrides dest_city for some parcels,
+    # init_transports/final_transports map a van to the parcel it is holding at the first/last step
+    van_init_cities = kwargs.get('van_init_cities', {})
+    van_final_cities = kwargs.get('van_final_cities', {})
+    parcel_dest_cities = kwargs.get('parcel_dest_cities', {})
+    init_transports = kwargs.get('init_transports', {})
+    final_transports = kwargs.get('final_transports', {})
     
     # Initial constraints
     for v in vans:
-        clauses.append([getVarNumber(prop='inTown', van=v, city=base_city, time=0)])
+        clauses.append([getVarNumber(prop='inTown', van=v, city=van_init_cities.get(v, base_city), time=0)])
 
     for p in parcels:
         clauses.append([getVarNumber(prop='inTown', parcel=p, city=parcel_init_cities[p], time=0)])
 
     # Final constraints
     for p in parcels:
-        clauses.append([getVarNumber(prop='inTown', parcel=p, city=dest_city, time=steps)])
+        clauses.append([getVarNumber(prop='inTown', parcel=p, city=parcel_dest_cities.get(p, dest_city), time=steps)])
+
+    for v, c in van_final_cities.items():
+        clauses.append([getVarNumber(prop='inTown', van=v, city=c, time=steps)])
+
+    for v, p in final_transports.items():
+        if steps > 0:
+            # The van has to be holding the parcel when the plan continues
+            clauses.append([getVarNumber(prop='pickingUp', van=v, parcel=p, time=steps-1), getVarNumber(prop='transports', van=v, parcel=p, time=steps-1)])
+        else:
+            clauses.append([getVarNumber(prop='transports', van=v, parcel=p, time=0)])
 
     # Position constraints
     for t in range(0, steps+1):
@@ -271,8 +318,9 @@ def genClauses(**kwargs):
                     clauses.append([-getVarNumber(prop='transports', van=v, parcel=p, time=t), 
                                   getVarNumber(prop='pickingUp', van=v, parcel=p, time=t-1), 
                                   getVarNumber(prop='transports', van=v, parcel=p, time=t-1)])
-                else:
+                elif init_transports.get(v) != p:
                     # At time 0, no van is already transporting a parcel (can't be initialized with a parcel)
+                    # unless it was already holding it in the given initial state
                     clauses.append([-getVarNumber(prop='transports', van=v, parcel=p, time=0)])
         
         for p in parcels:
@@ -281,6 +329,162 @@ def genClauses(**kwargs):
     
     return clauses
 
+def cityDistances(roads, dest):
+    # Number of roads from every city to dest
+    dist = {dest: 0}
+    frontier = [dest]
+    while frontier:
+        next_frontier = []
+        for c in frontier:
+            for (c1, c2) in roads:
+                if c2 == c and c1 not in dist:
+                    dist[c1] = dist[c] + 1
+                    next_frontier.append(c1)
+        frontier = next_frontier
+    return dist
+
+def atMostClauses(lits, bound, name):
+    # Sequential counter: at most bound of lits are true, count(i,j) means that
+    # at least j of the first i lits are true
+    if bound >= len(lits):
+        return []
+    if bound == 0:
+        return [[-l] for l in lits]
+    count = {}
+    for i in range(1, len(lits)):
+        for j in range(1, bound+1):
+            addVarName("%s,%d,%d)" % (name, i, j))
+            count[(i, j)] = varCount()
+    clauses = []
+    n = len(lits)
+    clauses.append([-lits[0], count[(1, 1)]])
+    for j in range(2, bound+1):
+        clauses.append([-count[(1, j)]])
+    for i in range(2, n):
+        clauses.append([-lits[i-1], count[(i, 1)]])
+        clauses.append([-count[(i-1, 1)], count[(i, 1)]])
+        for j in range(2, bound+1):
+            clauses.append([-lits[i-1], -count[(i-1, j-1)], count[(i, j)]])
+            clauses.append([-count[(i-1, j)], count[(i, j)]])
+        clauses.append([-lits[i-1], -count[(i-1, bound)]])
+    clauses.append([-lits[n-1], -count[(n-1, bound)]])
+    return clauses
+
+## Optional implied constraints, added to the clauses of genClauses to make the solver prove
+## short horizons UNSAT faster. None of them changes which horizons are satisfiable: they are
+## either consequences of the clauses or only rule out useless actions of a plan (that can
+## be dropped without making the plan longer).
+IMPLIED_CONSTRAINTS = ['delivered_stay', 'ground_items', 'final_step', 'distance', 'remaining_work']
+
+## Names of the auxiliary variables of the implied constraints, they are not facts of the plan
+IMPLIED_AUXILIARY = ('awaiting', 'above', 'below', 'count')
+
+## Comma separated implied constraints added by default ("" for none)
+impliedConstraints = os.getenv("MOVERS_IMPLIED_CONSTRAINTS", ",".join(IMPLIED_CONSTRAINTS))
+
+## Largest counter (literals x bound) of the remaining_work constraint of a time step
+impliedCounterLimit = 20000
+
+def genImpliedClauses(implied, **kwargs):
+    clauses = []
+
+    steps = kwargs['steps']
+    vans = kwargs['vans']
+    parcels = kwargs['parcels']
+    cities = kwargs['cities']
+    roads = kwargs['roads']
+    parcel_init_cities = kwargs['parcel_init_cities']
+    dest_city = kwargs['dest_city']
+    parcel_dest_cities = kwargs.get('parcel_dest_cities', {})
+    final_transports = kwargs.get('final_transports', {})
+
+    dest = {p: parcel_dest_cities.get(p, dest_city) for p in parcels}
+    dist = {c: cityDistances(roads, c) for c in set(dest.values()) | {dest_city}}
+    # Parcels that have to be held at the last step may still be moving there
+    settled = [p for p in parcels if p not in final_transports.values()]
+
+    if 'delivered_stay' in implied:
+        # A delivered parcel stays where it is and is never picked up there
+        for p in settled:
+            for t in range(0, steps):
+                clauses.append([-getVarNumber(prop='inTown', parcel=p, city=dest[p], time=t), getVarNumber(prop='inTown', parcel=p, city=dest[p], time=t+1)])
+                for v in vans:
+                    clauses.append([-getVarNumber(prop='inTown', parcel=p, city=dest[p], time=t), -getVarNumber(prop='pickingUp', van=v, parcel=p, time=t)])
+
+    if 'ground_items' in implied:
+        # Parcels that start at their destination need no action at all
+        for p in settled:
+            if parcel_init_cities[p] == dest[p]:
+                for t in range(0, steps+1):
+                    clauses.append([getVarNumber(prop='inTown', parcel=p, city=dest[p], time=t)])
+                    for v in vans:
+                        clauses.append([-getVarNumber(prop='pickingUp', van=v, parcel=p, time=t)])
+                        clauses.append([-getVarNumber(prop='transports', van=v, parcel=p, time=t)])
+
+    if 'final_step' in implied:
+        # Nothing is carried at the last step, so nothing is picked up at the step before
+        for v in vans:
+            for p in parcels:
+                if final_transports.get(v) == p:
+                    continue
+                clauses.append([-getVarNumber(prop='transports', van=v, parcel=p, time=steps)])
+                clauses.append([-getVarNumber(prop='pickingUp', van=v, parcel=p, time=steps)])
+                if steps > 0:
+                    clauses.append([-getVarNumber(prop='pickingUp', van=v, parcel=p, time=steps-1)])
+
+    if 'distance' in implied:
+        # A parcel d roads away from its destination at time t needs d more steps, and one
+        # more for its pickup if nobody is carrying it
+        for p in parcels:
+            for t in range(0, steps+1):
+                for c in cities:
+                    d = dist[dest[p]].get(c, steps + 1)
+                    if d > steps - t:
+                        clauses.append([-getVarNumber(prop='inTown', parcel=p, city=c, time=t)])
+                    elif d > 0 and d + 1 > steps - t:
+                        clauses.append([-getVarNumber(prop='inTown', parcel=p, city=c, time=t)] + [getVarNumber(prop='transports', van=v, parcel=p, time=t) for v in vans])
+
+    if 'remaining_work' in implied and all(dest[p] == dest_city for p in parcels):
+        # Worker-steps still needed at time t: every parcel k or more roads away from its
+        # destination has to be carried down the k-th road, a worker carries at most one
+        # parcel per step and has to come back up the road to carry another one (unless it
+        # starts above it), and every parcel nobody is carrying needs a pickup. Counted with
+        # unit literals: 2 per (parcel, road) still to go down, 1 per (worker, road) below
+        # the worker, 1 per parcel to pick up, at most len(vans)*(steps-t+levels) of them.
+        levels = max([d for p in parcels for d in dist[dest[p]].values()] + [0])
+        for t in range(0, steps):
+            bound = len(vans) * (steps - t + levels)
+            size = (2 * len(parcels) + len(vans)) * levels + len(parcels)
+            if bound >= size or size * bound > impliedCounterLimit:
+                continue
+            work = []
+            for p in parcels:
+                addVarName("awaiting(%d,%s)" % (t, p))
+                waiting = varCount()
+                work.append(waiting)
+                for c in cities:
+                    d = dist[dest[p]].get(c, 0)
+                    if d > 0:
+                        clauses.append([-getVarNumber(prop='inTown', parcel=p, city=c, time=t), waiting] + [getVarNumber(prop='transports', van=v, parcel=p, time=t) for v in vans])
+                for k in range(1, levels+1):
+                    addVarName("above(%d,%s,%d)" % (t, p, k))
+                    above = varCount()
+                    work += [above, above]
+                    for c in cities:
+                        if dist[dest[p]].get(c, 0) >= k:
+                            clauses.append([-getVarNumber(prop='inTown', parcel=p, city=c, time=t), above])
+            for v in vans:
+                for k in range(1, levels+1):
+                    addVarName("below(%d,%s,%d)" % (t, v, k))
+                    below = varCount()
+                    work.append(below)
+                    for c in cities:
+                        if dist[dest_city].get(c, 0) < k:
+                            clauses.append([-getVarNumber(prop='inTown', van=v, city=c, time=t), below])
+            clauses += atMostClauses(work, bound, "count(%d" % t)
+
+    return clauses
+
 ## A helper function to print the cnf header (do not modify)
 def getDimacsHeader(clauses):
     cnt = varCount()
@@ -372,7 +576,7 @@ def printResult(res):
 
     return sorted(true_vars)
 
-def main(steps, floors, roads, items, man, parcels):
+def main(steps, floors, roads, items, man, parcels, vans=None, timeout=None, cnf_path=None, preprocess_cnf=None, hints=None, implied=None, **boundary):
     path = shutil.which(SATsolver.split()[0])
     if path is None:
         if SATsolver == defSATsolver:
@@ -386,7 +590,7 @@ def main(steps, floors, roads, items, man, parcels):
     kwargs['steps'] = steps
 
     # Hardcoded arguments
-    kwargs['vans'] = ["v_%d" % p for p in range(0, man)]
+    kwargs['vans'] = vans if vans is not None else ["v_%d" % p for p in range(0, man)]
     kwargs['parcels'] = parcels
     
     # Map
@@ -400,28 +604,76 @@ def main(steps, floors, roads, items, man, parcels):
     
     # Final condition
     kwargs['dest_city'] = cities[0]
+    kwargs.update(boundary)
     ##+ End of code insertion
 
+    resetVarNames()
     genVarNames(**kwargs)
     clauses = genClauses(**kwargs)
 
-    head = getDimacsHeader(clauses)
-    cnf = toDimacsCnf(clauses)
-
-    # Here we create a temporary cnf file for SATsolver
-    fl = open("tmp_prob.cnf", "w")
-    fl.write("\n".join([head, cnf]) + "\n")
-    fl.close()
-
-    # Run the SATsolver
-    solverOutput = Popen([SATsolver + " tmp_prob.cnf"], stdout=PIPE, shell=True).communicate()[0]
-    res = solverOutput.decode('utf-8')
+    if preprocess_cnf is None:
+        preprocess_cnf = preprocessCNF
+    if preprocess_cnf:
+        # canTransport and moves are only helpers of the encoding, they can be eliminated
+        auxiliary = [num for num in allVarNumbers() if varNumberToName(num).startswith(('canTransport', 'moves'))]
+        clauses, reconstruction = preprocess(clauses, eliminate=auxiliary)
+
+    if implied is None:
+        implied = [name for name in impliedConstraints.split(',') if name]
+    if implied:
+        # Added after the preprocessing, that would only spend time on the counters: the
+        # implied clauses do not use the eliminated variables and are satisfied by the
+        # reconstructed models. The variables fixed by the unit propagation are no longer
+        # in the clauses, their values are put in the implied clauses.
+        implied_clauses = genImpliedClauses(implied, **kwargs)
+        if preprocess_cnf:
+            implied_clauses = assign_units(implied_clauses, reconstruction)
+        clauses += implied_clauses if implied_clauses is not None else [[1], [-1]]
+
+    if hints is not None:
+        # The SATsolver executable takes no hints (true facts of a known plan), use the z3 API
+        values = hint_values(hints, steps, varCount(), varNumberToName)
+        # The plan says nothing of the auxiliary variables of the implied constraints
+        values = {num: value for num, value in values.items() if not varNumberToName(num).startswith(IMPLIED_AUXILIARY)}
+        res = solve_with_hints(clauses, varCount(), values, timeout)
+        if res.startswith("s UNKNOWN"):
+            return None, 'TIMEOUT'
+    else:
+        # Here we create a temporary cnf file for SATsolver, a new one for every call
+        # unless a path is given
+        temporary = cnf_path is None
+        if temporary:
+            fd, cnf_path = tempfile.mkstemp(suffix='.cnf')
+            os.close(fd)
+        try:
+            head = getDimacsHeader(clauses)
+            cnf = toDimacsCnf(clauses)
+            fl = open(cnf_path, "w")
+            fl.write("\n".join([head, cnf]) + "\n")
+            fl.close()
+
+            # Run the SATsolver, giving up after timeout seconds if one is given
+            solver = Popen(SATsolver.split() + [cnf_path], stdout=PIPE)
+            try:
+                solverOutput = solver.communicate(timeout=timeout)[0]
+            except TimeoutExpired:
+                solver.kill()
+                solver.communicate()
+                return None, 'TIMEOUT'
+        finally:
+            if temporary:
+                os.remove(cnf_path)
+        res = solverOutput.decode('utf-8')
+    if preprocess_cnf:
+        res = reconstruct_output(res, reconstruction, varCount())
     print("--------------------------")
     facts = printResult(res)
     print("--------------------------")
+    if facts is not None and implied:
+        facts = [f for f in facts if not f.startswith(IMPLIED_AUXILIARY)]
     return facts, res.strip().split()[1]  # Print the last line of the output, which is the result
 
-def run_sat_solver(items_l = [], workers=3):
+def build_instance(items_l):
     floors = [str(i) for i in range(0, len(items_l))]
     roads = []
     for i in range(0, len(items_l)-1):
@@ -436,10 +688,34 @@ def run_sat_solver(items_l = [], workers=3):
             count += 1
             items.update({items_l[i][j]+str(count) + '_floor' + str(floors[i]) : floors[i]})
             parcels.append(items_l[i][j]+str(count) + '_floor' + str(floors[i]))
-    step = 0
+    return floors, roads, items, parcels
+
+def getBoundsIndex():
+    global gBoundsIndex
+    with gBoundsIndexLock:
+        if gBoundsIndex is None:
+            gBoundsIndex = BoundsIndex(boundsIndexPath or None)
+    return gBoundsIndex
+
+def search_bounds(items_l, workers):
+    # Every horizon below lower is UNSAT, upper steps are enough (None if not known yet)
+    floors, roads, items, parcels = build_instance(items_l)
+    lower, upper = getBoundsIndex().bounds(workers, floor_counts(items_l))
+    return max(lower, lower_bound_steps(items, workers)), upper
+
+def run_sat_solver(items_l = [], workers=3, hints=None):
+    floors, roads, items, parcels = build_instance(items_l)
+    counts = floor_counts(items_l)
+    lower, upper = search_bounds(items_l, workers)
+    step = lower
     res = 'UNSATISFIABLE'
     facts = []
     while (res == 'UNSATISFIABLE'):
-        facts, res = main(step, floors, roads, items, workers, parcels)
+        # The known upper bound is always satisfiable, the search ends there at the latest
+        facts, res = main(step, floors, roads, items, workers, parcels, hints=hints)
+        if res == 'UNSATISFIABLE':
+            getBoundsIndex().record(workers, counts, lower=step+1)
         step += 1
+    if res == 'SATISFIABLE':
+        getBoundsIndex().record(workers, counts, lower=step-1, upper=step-1)
     return facts, res, step
\ No newline at end of file
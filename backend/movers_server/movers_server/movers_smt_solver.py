@@ -0,0 +1,145 @@
+# SMT formulation of the movers problem, solved with the z3 API.
+#
+# Instead of one propositional variable for every (object, floor, time) the floors are
+# integers: a worker moves by -1, 0 or +1 floor at every step, an item is on the floor of
+# the worker carrying it and what a worker picks up or carries is the index of the item
+# (-1 for nothing). The transitions of the steps stay in the solver across horizons, only
+# the goal (every item on the ground floor at the last step) is pushed and popped.
+# Plans come back as the same true facts of the CNF encoding.
+
+from .movers_sat_solver import build_instance, search_bounds, getBoundsIndex
+from .bounds_index import floor_counts
+from .schedules import IDLE, schedule_to_facts
+
+
+class MoversSMT:
+
+    def __init__(self, items_l, workers, timeout=None):
+        import z3
+        self.z3 = z3
+        self.floors, self.roads, self.items, self.parcels = build_instance(items_l)
+        self.vans = ["v_%d" % v for v in range(0, workers)]
+        # Every engine has its own z3 context, the global one is not thread safe
+        self.ctx = z3.Context()
+        self.solver = z3.Solver(ctx=self.ctx)
+        if timeout is not None:
+            self.solver.set('timeout', int(timeout * 1000))
+
+        self.pos = {v: [] for v in self.vans}
+        self.item_pos = {p: [] for p in self.parcels}
+        self.pick = {v: [] for v in self.vans}
+        self.carry = {v: [] for v in self.vans}
+        self.add_time(0)
+        for v in self.vans:
+            self.solver.add(self.pos[v][0] == 0)
+        for p in self.parcels:
+            self.solver.add(self.item_pos[p][0] == int(self.items[p]))
+
+    def steps(self):
+        return len(self.pick[self.vans[0]]) if self.vans else 0
+
+    def add_time(self, t):
+        # Positions at time step t
+        z3 = self.z3
+        top = len(self.floors) - 1
+        for v in self.vans:
+            x = z3.Int("pos_%s_%d" % (v, t), self.ctx)
+            self.solver.add(x >= 0, x <= top)
+            self.pos[v].append(x)
+        for p in self.parcels:
+            x = z3.Int("pos_%s_%d" % (p, t), self.ctx)
+            self.solver.add(x >= 0, x <= top)
+            self.item_pos[p].append(x)
+
+    def add_step(self):
+        # Actions between the last time step and a new one
+        z3 = self.z3
+        s = self.solver
+        t = self.steps()
+        self.add_time(t + 1)
+        n = len(self.parcels)
+        for v in self.vans:
+            pick = z3.Int("pick_%s_%d" % (v, t), self.ctx)
+            carry = z3.Int("carry_%s_%d" % (v, t), self.ctx)
+            s.add(pick >= -1, pick < n, carry >= -1, carry < n)
+            self.pick[v].append(pick)
+            self.carry[v].append(carry)
+
+            here, there = self.pos[v][t], self.pos[v][t + 1]
+            # Stairs only go one floor up or down
+            s.add(there - here <= 1, here - there <= 1)
+            if t == 0:
+                s.add(carry == -1)
+            for i, p in enumerate(self.parcels):
+                # Picking up: same floor, the worker does not move
+                s.add(z3.Implies(pick == i, z3.And(self.item_pos[p][t] == here, there == here)))
+                # Carrying: the item moves with the worker, that has to take the stairs
+                s.add(z3.Implies(carry == i, z3.And(self.item_pos[p][t] == here, there != here,
+                                                    self.item_pos[p][t + 1] == there)))
+                if t > 0:
+                    # Carrying only what was picked up or carried the step before,
+                    # a pickup is always followed by the transport of the item
+                    s.add(z3.Implies(carry == i, z3.Or(self.pick[v][t - 1] == i, self.carry[v][t - 1] == i)))
+                    s.add(z3.Implies(self.pick[v][t - 1] == i, carry == i))
+
+        for i, p in enumerate(self.parcels):
+            # Items only move when carried
+            s.add(z3.Implies(self.item_pos[p][t + 1] != self.item_pos[p][t],
+                             z3.Or([self.carry[v][t] == i for v in self.vans])))
+
+    def check(self, steps):
+        # Solves the horizon of steps, returns the schedule or None (and the z3 result)
+        z3 = self.z3
+        while self.steps() < steps:
+            self.add_step()
+        self.solver.push()
+        for p in self.parcels:
+            self.solver.add(self.item_pos[p][steps] == 0)
+        if steps > 0:
+            # A pickup is followed by a transport, so there is none at the last step
+            for v in self.vans:
+                self.solver.add(self.pick[v][steps - 1] == -1)
+        result = self.solver.check()
+        schedule = self.decode(steps) if result == z3.sat else None
+        self.solver.pop()
+        return schedule, result
+
+    def decode(self, steps):
+        model = self.solver.model()
+        value = lambda x: model.eval(x, model_completion=True).as_long()
+        schedule = {}
+        for v in self.vans:
+            actions = []
+            for t in range(0, steps):
+                pick = value(self.pick[v][t])
+                carry = value(self.carry[v][t])
+                here, there = value(self.pos[v][t]), value(self.pos[v][t + 1])
+                if pick >= 0:
+                    actions.append(('pickingUp', self.parcels[pick]))
+                elif here != there:
+                    actions.append(('goesTo', str(here), str(there), self.parcels[carry] if carry >= 0 else None))
+                else:
+                    actions.append(IDLE)
+            schedule[v] = actions
+        return schedule
+
+
+def smt_search(items_l, workers, first=None, timeout=None):
+    # Horizons from first (the best known lower bound by default) up to the first satisfiable one
+    import z3
+    engine = MoversSMT(items_l, workers, timeout)
+    steps = search_bounds(items_l, workers)[0] if first is None else first
+    while True:
+        schedule, result = engine.check(steps)
+        if result == z3.sat:
+            return schedule_to_facts(schedule, engine.items), 'SATISFIABLE', steps + 1
+        if result != z3.unsat:
+            return None, 'TIMEOUT', steps + 1
+        steps += 1
+
+
+def run_smt_solver(items_l=[], workers=3):
+    facts, res, steps = smt_search(items_l, workers)
+    if res == 'SATISFIABLE':
+        getBoundsIndex().record(workers, floor_counts(items_l), lower=steps-1, upper=steps-1)
+    return facts, res, steps
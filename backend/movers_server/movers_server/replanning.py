@@ -0,0 +1,113 @@
+# Replanning from the state of a move that is already going on.
+#
+# The state gives the floor of every worker still on the job, the item each of them is
+# holding and the floor of every item still to bring down (new items included). Only
+# the remaining steps are encoded, starting from that state, and the rest of the previous
+# plan is both the hints of the solver and, if it is still valid, the plan to beat.
+
+import time
+
+from .movers_sat_solver import main
+from .solver_hints import fact_time, shift_facts
+from .schedules import (trip_cost, pad_schedule, schedule_length, simulate_schedule,
+                        schedule_to_facts, facts_to_schedule)
+
+
+def state_lower_bound(workers, holding, items):
+    # Like `lower_bound_steps`, but workers may already be upstairs: an item needs at
+    # least its pickup and one carried step per floor, a held item only the carried steps
+    costs = [int(f) + (0 if p in holding.values() else 1) for p, f in items.items() if int(f) > 0]
+    if not costs or not workers:
+        return 0
+    return max(max(costs), -(-sum(costs) // len(workers)))
+
+
+def greedy_from_state(workers, holding, items):
+    # Held items are brought down first, then every item goes to the worker that can
+    # deliver it the earliest
+    schedule = {}
+    at = {}
+    for v, floor in workers.items():
+        actions = []
+        floor = int(floor)
+        p = holding.get(v)
+        if p is not None and int(items.get(p, '0')) > 0:
+            for f in range(floor, 0, -1):
+                actions.append(('goesTo', str(f), str(f - 1), p))
+            floor = 0
+        schedule[v] = actions
+        at[v] = floor
+
+    carried = {p for v, p in holding.items() if int(items.get(p, '0')) > 0}
+    for p in sorted(items, key=lambda p: (-trip_cost(items[p]), p)):
+        if p in carried or int(items[p]) == 0:
+            continue
+        target = int(items[p])
+        v = min(workers, key=lambda v: (len(schedule[v]) + abs(at[v] - target) + target + 1, v))
+        step = 1 if target > at[v] else -1
+        for f in range(at[v], target, step):
+            schedule[v].append(('goesTo', str(f), str(f + step), None))
+        schedule[v].append(('pickingUp', p))
+        for f in range(target, 0, -1):
+            schedule[v].append(('goesTo', str(f), str(f - 1), p))
+        at[v] = 0
+    return schedule
+
+
+def delivers(schedule, workers, holding, items):
+    # The schedule is valid from the state and brings every item down
+    try:
+        states = simulate_schedule(schedule, items, van_cities=workers, holding=holding)
+    except (ValueError, KeyError):
+        return False
+    return all(f == '0' for f in states[-1][1].values())
+
+
+def replan(workers, holding, items, floors_count=None, previous_plan=None, start=0, time_limit=1.0):
+    # Returns the true facts of the new plan (times relative to the state), the result,
+    # the steps + 1 and the engine that produced the plan
+    started = time.time()
+    vans = sorted(workers, key=lambda v: (len(v), v))
+    parcels = sorted(items)
+    if floors_count is None:
+        floors_count = max([int(f) for f in list(workers.values()) + list(items.values())] + [0]) + 1
+    floors = [str(i) for i in range(0, floors_count)]
+    roads = []
+    for i in range(0, floors_count - 1):
+        roads.append((floors[i], floors[i + 1]))
+        roads.append((floors[i + 1], floors[i]))
+
+    # Best plan known so far: the rest of the previous plan if it still works, else the greedy one
+    best, engine, hints = None, 'greedy', None
+    if previous_plan:
+        hints = shift_facts(previous_plan, start)
+        steps = max([fact_time(f) for f in hints] + [0])
+        suffix = facts_to_schedule(hints, vans, steps)
+        if delivers(suffix, workers, holding, items):
+            best, engine = suffix, 'previous'
+    greedy = greedy_from_state(workers, holding, items)
+    if best is None or schedule_length(greedy) < schedule_length(best):
+        best, engine = greedy, 'greedy'
+    upper = schedule_length(best)
+    best = pad_schedule(best, upper)
+
+    # Shorter plans from the best one down: every satisfiable horizon improves the plan,
+    # the first unsatisfiable one proves it optimal
+    facts = schedule_to_facts(best, items, van_cities=workers, holding=holding)
+    if hints is None:
+        hints = facts
+    lower = state_lower_bound(workers, holding, items)
+    steps = upper - 1
+    while steps >= lower and time.time() < started + time_limit:
+        new_facts, new_res = main(steps, floors, roads, items, len(vans), parcels,
+                                  vans=vans,
+                                  van_init_cities=workers,
+                                  init_transports=holding,
+                                  hints=hints,
+                                  timeout=started + time_limit - time.time())
+        if new_res != 'SATISFIABLE':
+            break
+        facts, hints, upper, engine = new_facts, new_facts, steps, 'sat'
+        steps -= 1
+
+    return facts, 'SATISFIABLE', upper + 1, engine
@@ -0,0 +1,186 @@
+# Plans as explicit schedules, independent from the SAT encoding.
+#
+# A schedule gives for every worker the action it performs at each time step:
+#   ('idle',)                            the worker stays where it is
+#   ('goesTo', from, to, parcel | None)  the worker takes the stairs, carrying parcel if not None
+#   ('pickingUp', parcel)                the worker picks up a parcel on its floor
+# Schedules can be built by heuristics, decoded from SAT facts and turned back into the
+# same facts the SAT solver returns, so every engine ends in `parse_SAT_facts_by_time`.
+
+IDLE = ('idle',)
+
+
+def trip_cost(floor, dest_floor='0'):
+    # Going up, picking the item up and carrying it down
+    distance = abs(int(floor) - int(dest_floor))
+    return 2 * distance + 1 if distance > 0 else 0
+
+
+def lower_bound_steps(items, workers, dest_floor='0'):
+    # Every item out of place needs a pickup and one carried step per floor, every carried
+    # step down needs a step up of the same worker before: the work cannot be split in less
+    # than ceil(total / workers) steps, nor the deepest item fetched in less than its trip
+    costs = [trip_cost(f, dest_floor) for f in items.values()]
+    if not costs or workers <= 0:
+        return 0
+    return max(max(costs), -(-sum(costs) // workers))
+
+
+def greedy_assignment(items, vans, dest_floor='0'):
+    # Longest trips first, each to the worker that is free the earliest
+    loads = {v: 0 for v in vans}
+    assignment = {v: [] for v in vans}
+    for p in sorted(items, key=lambda p: (-trip_cost(items[p], dest_floor), p)):
+        if trip_cost(items[p], dest_floor) == 0:
+            continue
+        v = min(vans, key=lambda v: (loads[v], int(v[2:])))
+        assignment[v].append(p)
+        loads[v] += trip_cost(items[p], dest_floor)
+    return assignment
+
+
+def schedule_from_assignment(assignment, items, dest_floor='0', van_cities=None):
+    # Every worker fetches its items one after the other, starting from its current floor
+    schedule = {}
+    for v, parcels in assignment.items():
+        floor = int((van_cities or {}).get(v, dest_floor))
+        actions = []
+        for p in parcels:
+            target = int(items[p])
+            step = 1 if target > floor else -1
+            for f in range(floor, target, step):
+                actions.append(('goesTo', str(f), str(f + step), None))
+            actions.append(('pickingUp', p))
+            step = 1 if int(dest_floor) > target else -1
+            for f in range(target, int(dest_floor), step):
+                actions.append(('goesTo', str(f), str(f + step), p))
+            floor = int(dest_floor)
+        schedule[v] = actions
+    return schedule
+
+
+def action_parcel(action):
+    if action[0] == 'pickingUp':
+        return action[1]
+    if action[0] == 'goesTo':
+        return action[3]
+    return None
+
+
+def schedule_length(schedule):
+    # Trailing idle steps do not count
+    length = 0
+    for actions in schedule.values():
+        for t in range(len(actions) - 1, -1, -1):
+            if actions[t] != IDLE:
+                length = max(length, t + 1)
+                break
+    return length
+
+
+def worker_length(schedule, v):
+    return schedule_length({v: schedule[v]})
+
+
+def pad_schedule(schedule, steps):
+    return {v: (list(actions) + [IDLE] * steps)[:steps] for v, actions in schedule.items()}
+
+
+def simulate_schedule(schedule, items, van_cities=None, holding=None, dest_floor='0'):
+    # Returns the state before every step and after the last one, as a list of
+    # (van floors, parcel floors, parcel held by each van) tuples.
+    # Raises ValueError if the schedule breaks a rule of the SAT model.
+    steps = max([len(a) for a in schedule.values()] + [0])
+    vans_at = {v: (van_cities or {}).get(v, dest_floor) for v in schedule}
+    parcels_at = dict(items)
+    held = dict(holding or {})
+    picked = {}
+    states = [(dict(vans_at), dict(parcels_at), dict(held))]
+
+    for t in range(0, steps):
+        new_held = {}
+        # Several workers can carry the same item, as long as they go to the same floor
+        carried = {}
+        parcels_before = dict(parcels_at)
+        for v, actions in schedule.items():
+            action = actions[t] if t < len(actions) else IDLE
+            if v in picked and (action[0] != 'goesTo' or action[3] != picked[v]):
+                raise ValueError("%s has to transport %s right after picking it up" % (v, picked[v]))
+            if action[0] == 'pickingUp':
+                p = action[1]
+                if parcels_at[p] != vans_at[v]:
+                    raise ValueError("%s cannot pick up %s at time %d" % (v, p, t))
+                new_held[v] = p
+            elif action[0] == 'goesTo':
+                c1, c2, p = action[1], action[2], action[3]
+                if vans_at[v] != c1 or abs(int(c1) - int(c2)) != 1:
+                    raise ValueError("%s cannot go from %s to %s at time %d" % (v, c1, c2, t))
+                if p is not None:
+                    if held.get(v) != p or parcels_before[p] != c1 or carried.get(p, c2) != c2:
+                        raise ValueError("%s cannot transport %s at time %d" % (v, p, t))
+                    carried[p] = c2
+                    parcels_at[p] = c2
+                    new_held[v] = p
+                vans_at[v] = c2
+        held = new_held
+        picked = {v: action[1] for v, actions in schedule.items()
+                  for action in actions[t:t + 1] if action[0] == 'pickingUp'}
+        states.append((dict(vans_at), dict(parcels_at), dict(held)))
+    return states
+
+
+def schedule_to_facts(schedule, items, van_cities=None, holding=None, dest_floor='0'):
+    # The true facts of the SAT model for this schedule, as returned by `printResult`
+    states = simulate_schedule(schedule, items, van_cities, holding, dest_floor)
+    facts = []
+    for t, (vans_at, parcels_at, held) in enumerate(states):
+        for v, c in vans_at.items():
+            facts.append("inTown(%d,%s,%s)" % (t, v, c))
+            for p, c2 in parcels_at.items():
+                if c == c2:
+                    facts.append("canTransport(%d,%s,%s)" % (t, v, p))
+        for p, c in parcels_at.items():
+            facts.append("inTown(%d,%s,%s)" % (t, p, c))
+        if t == len(states) - 1:
+            break
+        for v, actions in schedule.items():
+            action = actions[t] if t < len(actions) else IDLE
+            if action[0] == 'pickingUp':
+                facts.append("pickingUp(%d,%s,%s)" % (t, v, action[1]))
+            elif action[0] == 'goesTo':
+                facts.append("goesTo(%d,%s,%s,%s)" % (t, v, action[1], action[2]))
+                facts.append("moves(%d,%s)" % (t, v))
+                if action[3] is not None:
+                    facts.append("transports(%d,%s,%s)" % (t, v, action[3]))
+                    facts.append("moves(%d,%s)" % (t, action[3]))
+    return sorted(facts)
+
+
+def facts_to_schedule(SAT_facts, vans, steps):
+    # Inverse of `schedule_to_facts`, facts at the last time step carry no action
+    goes_to = {}
+    transports = {}
+    pickups = {}
+    for f in SAT_facts:
+        action = f.split('(')[0]
+        params = f[len(action) + 1:-1].split(',')
+        if action == 'goesTo' and len(params) == 4:
+            goes_to[(int(params[0]), params[1])] = (params[2], params[3])
+        elif action == 'transports' and len(params) == 3:
+            transports[(int(params[0]), params[1])] = params[2]
+        elif action == 'pickingUp' and len(params) == 3:
+            pickups[(int(params[0]), params[1])] = params[2]
+
+    schedule = {}
+    for v in vans:
+        actions = []
+        for t in range(0, steps):
+            if (t, v) in pickups:
+                actions.append(('pickingUp', pickups[(t, v)]))
+            elif (t, v) in goes_to:
+                c1, c2 = goes_to[(t, v)]
+                actions.append(('goesTo', c1, c2, transports.get((t, v))))
+            else:
+                actions.append(IDLE)
+        schedule[v] = actions
+    return schedule
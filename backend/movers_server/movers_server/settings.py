@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    # Plans of long horizons are large, compress them when the client accepts gzip
+    'django.middleware.gzip.GZipMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -132,3 +134,15 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Admission control of /runSAT, see movers_server/admission.py for all the options
+MOVERS_ADMISSION = {
+    'fast_limit': 2.0,
+    'slow_limit': 60.0,
+    'fast_slots': 4,
+    'slow_slots': 1,
+    'api_slots': 1,
+    'queue_timeout': 5.0,
+    'runs_log': BASE_DIR / 'solver_runs.jsonl',
+}
@@ -0,0 +1,99 @@
+# Solving with hints: the values of a known (partial) plan given to the solver.
+#
+# The hints are the true facts of a plan, facts of time steps after the end of the plan
+# repeat the positions of its last step. The z3 command line solver takes no hints, so
+# hinted problems are solved through the z3 API: the hints become initial values of the
+# variables or, on versions that do not support them, soft assumptions that are dropped
+# when they conflict with the clauses.
+
+import re
+
+MODEL_VALUE = re.compile(r"\(define-fun x(\d+) \(\) Bool\s+(true|false)\)")
+
+
+def fact_time(fact):
+    return int(fact.split('(')[1].split(',')[0])
+
+
+def with_time(fact, time):
+    name, params = fact.split('(', 1)
+    return "%s(%d,%s" % (name, time, params.split(',', 1)[1])
+
+
+def shift_facts(SAT_facts, offset):
+    # Moves a plan offset steps earlier, dropping what happens before
+    return [with_time(f, fact_time(f) - offset) for f in SAT_facts if fact_time(f) >= offset]
+
+
+def pad_facts(SAT_facts, steps):
+    # Extends (or cuts) a plan to steps, repeating the positions of its last step
+    last = max([fact_time(f) for f in SAT_facts] + [0])
+    facts = [f for f in SAT_facts if fact_time(f) <= steps]
+    positions = [f for f in SAT_facts if fact_time(f) == last and f.startswith(('inTown', 'canTransport'))]
+    for time in range(last + 1, steps + 1):
+        facts += [with_time(f, time) for f in positions]
+    return facts
+
+
+def rename_facts(SAT_facts, names):
+    result = []
+    for f in SAT_facts:
+        name, params = f.split('(', 1)
+        params = params[:-1].split(',')
+        result.append("%s(%s)" % (name, ",".join(names.get(p, p) for p in params)))
+    return result
+
+
+def hint_values(SAT_facts, steps, var_count, var_number_to_name):
+    # Value of every variable in the (padded) plan
+    facts = set(pad_facts(SAT_facts, steps))
+    return {num: var_number_to_name(num) in facts for num in range(1, var_count + 1)}
+
+
+def solve_with_hints(clauses, var_count, hints, timeout=None):
+    # Solves the clauses through the z3 API, returns the output of a DIMACS solver
+    import z3
+
+    def lit(l):
+        return "x%d" % l if l > 0 else "(not x%d)" % -l
+
+    used = sorted({abs(l) for c in clauses for l in c})
+    smt = "".join("(declare-const x%d Bool)" % n for n in used)
+    smt += "".join("(assert (or %s))" % " ".join(map(lit, c)) if c else "(assert false)" for c in clauses)
+
+    # A context for every call, the global one is not thread safe
+    ctx = z3.Context()
+    solver = z3.SolverFor('QF_FD', ctx=ctx)
+    if timeout is not None:
+        solver.set('timeout', int(timeout * 1000))
+    solver.from_string(smt)
+    hinted = [(z3.Bool("x%d" % n, ctx), hints[n]) for n in used if n in hints]
+
+    if hasattr(solver, 'set_initial_value'):
+        for var, value in hinted:
+            solver.set_initial_value(var, z3.BoolVal(value, ctx))
+        result = solver.check()
+    else:
+        # Soft assumptions: drop the ones in the unsat core until the rest is consistent
+        assumptions = [var if value else z3.Not(var) for var, value in hinted]
+        result = solver.check(*assumptions)
+        for _ in range(0, 10):
+            if result != z3.unsat or not assumptions:
+                break
+            core = {a.get_id() for a in solver.unsat_core()}
+            if not core:
+                break
+            assumptions = [a for a in assumptions if a.get_id() not in core]
+            result = solver.check(*assumptions)
+        if result == z3.unsat and assumptions:
+            result = solver.check()
+
+    if result == z3.sat:
+        # One call for the whole model, evaluating the variables one by one through the API
+        # takes longer than the solve. Variables missing from the model are false.
+        true = {int(n) for n, value in MODEL_VALUE.findall(solver.model().sexpr()) if value == 'true'}
+        asgn = [n if n in true else -n for n in range(1, var_count + 1)]
+        return "s SATISFIABLE\nv " + " ".join(map(str, asgn)) + " 0\n"
+    if result == z3.unsat:
+        return "s UNSATISFIABLE\n"
+    return "s UNKNOWN\n"
@@ -18,10 +18,12 @@ from django.contrib import admin
 from django.http import HttpResponse
 from django.urls import path
 from django.urls import include
-from .controllers import run_SAT, run_tests
+from .controllers import run_SAT, run_LNS, replan, run_tests
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('runSAT', run_SAT),
+    path('runLNS', run_LNS),
+    path('replan', replan),
     path('runTests', run_tests),
 ]
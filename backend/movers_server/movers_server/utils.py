@@ -1,3 +1,8 @@
+import json
+
+from django.http import HttpResponse, JsonResponse
+
+
 def parse_SAT_facts_by_workers(SAT_facts):
     workers_facts = {}
     for f in SAT_facts:
@@ -136,3 +141,95 @@ def parse_SAT_facts_by_time(SAT_facts):
     time_facts = {k: sorted(v, key=lambda x: x.get('time', 0)) for k, v in cleared_time_facts.items()}
 
     return time_facts
+
+
+# Integer codes used by the compact response format, the index is the code
+COMPACT_ACTION_CODES = ['idle', 'up', 'down', 'pickingUp', 'transportsUp', 'transportsDown']
+
+
+def parse_SAT_facts_compact(SAT_facts, steps):
+    # Compact representation of a plan:
+    # - timeline: for each worker one integer code (see COMPACT_ACTION_CODES) per time step
+    # - pickups: for each worker the [time, object index] pairs of its pickups, a transport
+    #   always refers to the last object picked up by the same worker
+    # - positions: for each worker the starting floor followed by the floor delta of each step
+    worker_floors = {}
+    goes_to = {}
+    transports = set()
+    pickups = {}
+    objects = set()
+
+    for f in SAT_facts:
+        action = f.split('(')[0]
+        params = f[len(action) + 1:-1].split(',')
+
+        if action == 'inTown' and len(params) == 3:
+            time, obj, floor = params
+            if obj.startswith('v_'):
+                worker_floors.setdefault(obj, {})[int(time)] = int(floor)
+            else:
+                objects.add(obj)
+        elif action == 'goesTo' and len(params) == 4:
+            time, worker, from_floor, to_floor = params
+            goes_to[(int(time), worker)] = int(to_floor) - int(from_floor)
+        elif action == 'transports' and len(params) == 3:
+            time, worker, obj = params
+            transports.add((int(time), worker))
+        elif action == 'pickingUp' and len(params) == 3:
+            time, worker, obj = params
+            pickups.setdefault(worker, []).append((int(time), obj))
+
+    objects = sorted(objects)
+    object_index = {obj: idx for idx, obj in enumerate(objects)}
+    workers = sorted(worker_floors, key=lambda w: int(w[2:]))
+
+    timeline = {}
+    positions = {}
+    for worker in workers:
+        picks = {time for time, obj in pickups.get(worker, [])}
+        codes = []
+        for time in range(0, steps):
+            if time in picks:
+                codes.append(3)
+            elif (time, worker) in goes_to:
+                direction = 1 if goes_to[(time, worker)] > 0 else 2
+                codes.append(direction + 3 if (time, worker) in transports else direction)
+            else:
+                codes.append(0)
+        timeline[worker] = codes
+
+        floors = worker_floors[worker]
+        trace = [floors[0]]
+        for time in range(1, steps + 1):
+            trace.append(floors[time] - floors[time - 1])
+        positions[worker] = trace
+
+    return {
+        'codes': COMPACT_ACTION_CODES,
+        'objects': objects,
+        'workers': workers,
+        'timeline': timeline,
+        'pickups': {w: [[time, object_index[obj]] for time, obj in sorted(pickups[w]) if time < steps]
+                    for w in workers if w in pickups},
+        'positions': positions,
+    }
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def fast_json_dumps(data):
+    # Serialize with orjson when it is installed, it is several times faster than
+    # the standard json module on large plans
+    if orjson is None:
+        return json.dumps(data).encode('utf-8')
+    return orjson.dumps(data)
+
+
+def fast_json_response(data, **kwargs):
+    if orjson is None:
+        return JsonResponse(data, **kwargs)
+    return HttpResponse(fast_json_dumps(data), content_type='application/json', **kwargs)
@@ -0,0 +1,77 @@
+# Warm start of the SAT solver for new requests.
+#
+# The best plan available is used as hints (see solver_hints.py): the plan of a similar
+# instance solved before, with its items renamed, or else the greedy schedule.
+
+import threading
+from collections import OrderedDict
+
+from .bounds_index import floor_counts
+from .movers_sat_solver import build_instance, run_sat_solver
+from .solver_hints import rename_facts
+from .schedules import greedy_assignment, schedule_from_assignment, schedule_length, pad_schedule, schedule_to_facts
+
+
+def greedy_hints(items_l, workers):
+    floors, roads, items, parcels = build_instance(items_l)
+    vans = ["v_%d" % v for v in range(0, workers)]
+    schedule = schedule_from_assignment(greedy_assignment(items, vans), items)
+    return schedule_to_facts(pad_schedule(schedule, schedule_length(schedule)), items)
+
+
+class PlanCache:
+    # The last plans found, to warm start the requests of similar instances
+
+    def __init__(self, size=64):
+        self.size = size
+        self.plans = OrderedDict()
+        self.lock = threading.Lock()
+
+    def store(self, items_l, workers, SAT_facts):
+        floors, roads, items, parcels = build_instance(items_l)
+        with self.lock:
+            self.plans[(workers, floor_counts(items_l))] = (parcels, items, SAT_facts)
+            self.plans.move_to_end((workers, floor_counts(items_l)))
+            while len(self.plans) > self.size:
+                self.plans.popitem(last=False)
+
+    def similar(self, items_l, workers):
+        # Facts of the cached plan with the same workers and the closest items per floor,
+        # the n-th item of a floor takes the name of the n-th item of the same floor
+        counts = floor_counts(items_l)
+        floors, roads, items, parcels = build_instance(items_l)
+
+        def distance(key):
+            other = key[1]
+            size = max(len(counts), len(other))
+            return sum(abs((counts + (0,) * size)[i] - (other + (0,) * size)[i]) for i in range(0, size))
+
+        with self.lock:
+            candidates = [key for key in self.plans if key[0] == workers]
+            if not candidates:
+                return None
+            cached_parcels, cached_items, SAT_facts = self.plans[min(candidates, key=distance)]
+
+        names = {}
+        for floor in floors:
+            new = [p for p in parcels if items[p] == floor]
+            old = [p for p in cached_parcels if cached_items[p] == floor]
+            names.update(zip(old, new))
+        # Items with no counterpart keep their old name and do not match any variable
+        return rename_facts(SAT_facts, names)
+
+
+plan_cache = PlanCache()
+
+
+def warm_start_hints(items_l, workers):
+    # Best hints available for a new request
+    return plan_cache.similar(items_l, workers) or greedy_hints(items_l, workers)
+
+
+def run_warm_sat_solver(items_l=[], workers=3):
+    # `run_sat_solver` with every horizon warm started
+    facts, res, steps = run_sat_solver(items_l, workers, hints=warm_start_hints(items_l, workers))
+    if res == 'SATISFIABLE':
+        plan_cache.store(items_l, workers, facts)
+    return facts, res, steps